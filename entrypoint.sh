@@ -105,10 +105,12 @@ else:
 echo "Starting inference service..."
 cd /app
 
-# Start with gunicorn for better performance
+# Start with gunicorn for better performance. The app is an I/O-bound proxy
+# in front of ComfyUI, so gthread workers let concurrent /invocations wait on
+# ComfyUI without serializing behind a single sync worker.
 if command -v gunicorn >/dev/null 2>&1; then
     echo "Using gunicorn for production server..."
-    exec gunicorn -w 1 -b 0.0.0.0:8080 --timeout 300 --preload inference:app
+    exec gunicorn -k gthread --workers 2 --threads 16 -b 0.0.0.0:8080 --timeout 300 --preload inference:app
 else
     echo "Using Python built-in server..."
     exec python3 inference.py
@@ -1,15 +1,55 @@
 import os
+import asyncio
+import copy
+import errno
 import time
 import uuid
 import json
 import logging
+import shutil
+import threading
 import traceback
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, Optional
 from flask import Flask, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if msgspec is not None:
+    class HistoryEntry(msgspec.Struct):
+        """The one field we read from ComfyUI history; the rest is skipped."""
+        outputs: Optional[Dict[str, Any]] = None
+
+    history_decoder = msgspec.json.Decoder(Dict[str, HistoryEntry])
+else:
+    history_decoder = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,17 +58,118 @@ app = Flask(__name__)
 
 # Configuration
 COMFY_URL = "http://127.0.0.1:8188"
+COMFY_WS_URL = "ws://127.0.0.1:8188/ws"
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 
+WORKFLOW_DIR = "/app/ComfyUI/workflows"
+DEFAULT_WORKFLOW = os.path.join(WORKFLOW_DIR, "vibe_infinite.json")
+
+def find_fallback_workflow() -> Optional[str]:
+    """Locate any available workflow to use when the default is missing."""
+    try:
+        workflow_files = sorted(f for f in os.listdir(WORKFLOW_DIR) if f.endswith(".json"))
+    except OSError:
+        return None
+    if not workflow_files:
+        return None
+    return os.path.join(WORKFLOW_DIR, workflow_files[0])
+
+# Scan the workflow directory once per worker, not per request
+FALLBACK_WORKFLOW = find_fallback_workflow()
+
+@lru_cache(maxsize=4)
+def load_workflow(path: str, mtime: float) -> Dict[str, Any]:
+    """Load and parse a workflow template, cached until the file changes."""
+    with open(path, "r") as f:
+        return json.load(f)
+
+@lru_cache(maxsize=4)
+def load_workflow_blob(path: str, mtime: float) -> bytes:
+    """Serialized form of the cached template, for cheap per-request copies."""
+    return orjson.dumps(load_workflow(path, mtime))
+
+def fresh_workflow(path: str, mtime: float) -> Dict[str, Any]:
+    """Return a mutable copy of the cached workflow template.
+
+    Re-parsing the contiguous orjson blob is several times faster than
+    deepcopying the template's Python object graph; deepcopy remains as the
+    fallback when orjson is not installed.
+    """
+    if orjson is not None:
+        return orjson.loads(load_workflow_blob(path, mtime))
+    return copy.deepcopy(load_workflow(path, mtime))
+
+def json_response(payload: Dict[str, Any], status: int = 200):
+    """Build a JSON response, serializing with orjson when available."""
+    if orjson is not None:
+        return app.response_class(orjson.dumps(payload), status=status, mimetype="application/json")
+    response = jsonify(payload)
+    response.status_code = status
+    return response
+
+# Workflow input keys that receive request inputs
+INPUT_SLOT_KEYS = ("audio", "text_file", "image")
+
+@lru_cache(maxsize=4)
+def load_workflow_slots(path: str, mtime: float) -> Dict[str, tuple]:
+    """Index which node IDs expose each request-input slot in the template."""
+    template = load_workflow(path, mtime)
+    slots = {key: [] for key in INPUT_SLOT_KEYS}
+    for node_id, node in template.items():
+        inputs = node.get("inputs", {})
+        for key in INPUT_SLOT_KEYS:
+            if key in inputs:
+                slots[key].append(node_id)
+    return {key: tuple(node_ids) for key, node_ids in slots.items()}
+
+# Pooled HTTP session with keep-alive so ComfyUI calls reuse TCP connections
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.1)
+))
+http_session.headers.update({"Connection": "keep-alive"})
+
+# Multipart transfer settings shared by S3 uploads
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# Downloads use more ranged GETs since inputs land in RAM, not on disk
+S3_DOWNLOAD_CONFIG = TransferConfig(
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True
+)
+
+# Stage inputs on tmpfs when available so downloads skip the overlayfs/EBS
+INPUT_DIR = "/dev/shm/inputs" if os.path.isdir("/dev/shm") else "/app/inputs"
+
+# Route S3 traffic over the AWS edge network for cross-region clients.
+# Opt-in via S3_ACCELERATE=1; the target buckets must have Transfer
+# Acceleration enabled (aws s3api put-bucket-accelerate-configuration).
+S3_ACCELERATE = os.environ.get("S3_ACCELERATE") == "1"
+
 # Initialize S3 client with error handling
 try:
-    s3_client = boto3.client("s3", region_name=AWS_REGION)
+    s3_config = None
+    if S3_ACCELERATE:
+        s3_config = BotoConfig(s3={
+            "use_accelerate_endpoint": True,
+            "addressing_style": "virtual"
+        })
+        logger.info("S3 Transfer Acceleration enabled")
+    s3_client = boto3.client("s3", region_name=AWS_REGION, config=s3_config)
     logger.info("S3 client initialized successfully")
 except Exception as e:
     logger.warning(f"S3 client initialization failed: {e}")
     s3_client = None
 
-def resolve_input_path(uri: str, local_dir: str = "/app/inputs") -> str:
+def resolve_input_path(uri: str, local_dir: str = INPUT_DIR) -> str:
     """Resolve input file path from S3 URI or local path."""
     try:
         if uri.startswith("s3://") and s3_client:
@@ -42,7 +183,7 @@ def resolve_input_path(uri: str, local_dir: str = "/app/inputs") -> str:
             os.makedirs(local_dir, exist_ok=True)
             
             logger.info(f"Downloading {uri} to {local_path}")
-            s3_client.download_file(bucket, key, local_path)
+            s3_client.download_file(bucket, key, local_path, Config=S3_DOWNLOAD_CONFIG)
             return local_path
             
         else:
@@ -55,6 +196,26 @@ def resolve_input_path(uri: str, local_dir: str = "/app/inputs") -> str:
         logger.error(f"Error resolving input path {uri}: {e}")
         raise
 
+def move_output_file(local_path: str, out_path: str) -> None:
+    """Move a file, falling back to zero-copy sendfile across filesystems."""
+    try:
+        os.replace(local_path, out_path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # Different mounts: sendfile copies in-kernel without userspace buffers
+    size = os.path.getsize(local_path)
+    with open(local_path, "rb") as src, open(out_path, "wb") as dst:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    os.unlink(local_path)
+
 def upload_output(local_path: str, target: str) -> str:
     """Upload output file to S3 or local directory."""
     try:
@@ -67,7 +228,7 @@ def upload_output(local_path: str, target: str) -> str:
             key = f"{prefix}/{os.path.basename(local_path)}" if prefix else os.path.basename(local_path)
             
             logger.info(f"Uploading {local_path} to s3://{bucket}/{key}")
-            s3_client.upload_file(local_path, bucket, key)
+            s3_client.upload_file(local_path, bucket, key, Config=S3_TRANSFER_CONFIG)
             
             # Generate presigned URL
             url = s3_client.generate_presigned_url(
@@ -81,19 +242,75 @@ def upload_output(local_path: str, target: str) -> str:
             # Local directory
             os.makedirs(target, exist_ok=True)
             out_path = os.path.join(target, os.path.basename(local_path))
-            os.rename(local_path, out_path)
+            move_output_file(local_path, out_path)
             return out_path
             
     except Exception as e:
         logger.error(f"Error uploading output {local_path} to {target}: {e}")
         raise
 
-def submit_workflow(workflow_json: Dict[str, Any]) -> str:
+class WorkflowEventListener:
+    """Per-request WebSocket listener for ComfyUI execution events.
+
+    ComfyUI keeps exactly one socket per client id, so each request needs its
+    own id: a shared id would let concurrent requests evict each other's
+    sockets and miss their completion events. Start the listener before the
+    /prompt POST so no event can be lost, and submit with the same client_id.
+    """
+
+    def __init__(self):
+        self.client_id = str(uuid.uuid4())
+        self.connected = threading.Event()
+        self.done = threading.Event()
+        self.finished_prompts = set()
+        self.ws_app = None
+
+    def start(self) -> bool:
+        """Open the socket; returns True once connected."""
+        if websocket is None:
+            return False
+
+        self.ws_app = websocket.WebSocketApp(
+            f"{COMFY_WS_URL}?clientId={self.client_id}",
+            on_open=self.on_open,
+            on_message=self.on_message
+        )
+        threading.Thread(target=self.ws_app.run_forever, daemon=True).start()
+        return self.connected.wait(timeout=5)
+
+    def on_open(self, ws):
+        self.connected.set()
+
+    def on_message(self, ws, message):
+        try:
+            msg = json.loads(message)
+        except (ValueError, TypeError):
+            return  # binary preview frames
+        data = msg.get("data", {})
+        if msg.get("type") == "executing" and data.get("node") is None:
+            self.finished_prompts.add(data.get("prompt_id"))
+            self.done.set()
+
+    def wait(self, prompt_id: str, timeout: float) -> bool:
+        """Wait until prompt_id finishes; returns False on timeout."""
+        deadline = time.time() + timeout
+        while prompt_id not in self.finished_prompts:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.done.wait(timeout=remaining):
+                return False
+            self.done.clear()
+        return True
+
+    def close(self):
+        if self.ws_app is not None:
+            self.ws_app.close()
+
+def submit_workflow(workflow_json: Dict[str, Any], client_id: Optional[str] = None) -> str:
     """Submit workflow to ComfyUI and return prompt ID."""
     try:
-        response = requests.post(
+        response = http_session.post(
             f"{COMFY_URL}/prompt",
-            json={"prompt": workflow_json},
+            json={"prompt": workflow_json, "client_id": client_id or str(uuid.uuid4())},
             timeout=30
         )
         response.raise_for_status()
@@ -110,52 +327,176 @@ def submit_workflow(workflow_json: Dict[str, Any]) -> str:
         logger.error(f"Error submitting workflow: {e}")
         raise
 
-def wait_for_completion(prompt_id: str, poll_interval: float = 2.0, max_wait: int = 300) -> Dict[str, Any]:
-    """Wait for workflow completion and return results."""
+def parse_history(content: bytes, prompt_id: str) -> Optional[Dict[str, Any]]:
+    """Extract the finished entry for prompt_id from a history payload.
+
+    History responses carry metadata for every executed node; the typed
+    msgspec decoder pulls out just the outputs field without materializing
+    the rest of the tree. Falls back to stdlib json when msgspec is missing.
+    """
+    if history_decoder is not None:
+        entry = history_decoder.decode(content).get(prompt_id)
+        if entry is not None and entry.outputs is not None:
+            return {"outputs": entry.outputs}
+        return None
+
+    data = json.loads(content)
+    if prompt_id in data and "outputs" in data[prompt_id]:
+        return data[prompt_id]
+    return None
+
+def fetch_history(prompt_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch workflow results from ComfyUI history, or None if not finished."""
+    response = http_session.get(f"{COMFY_URL}/history/{prompt_id}", timeout=10)
+    response.raise_for_status()
+    return parse_history(response.content, prompt_id)
+
+# Background asyncio loop shared by all in-flight polls: one event-loop
+# thread and one aiohttp connection pool service every concurrent job instead
+# of each gunicorn thread running its own blocking HTTP poll
+async_loop = None
+async_loop_lock = threading.Lock()
+aiohttp_session = None
+
+def get_async_loop():
+    """Start the shared background event loop on first use."""
+    global async_loop
+    with async_loop_lock:
+        if async_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+            async_loop = loop
+    return async_loop
+
+async def get_aiohttp_session() -> "aiohttp.ClientSession":
+    """Create the shared aiohttp session lazily on the event loop."""
+    global aiohttp_session
+    if aiohttp_session is None:
+        aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=128, keepalive_timeout=60)
+        )
+    return aiohttp_session
+
+async def poll_for_completion_async(prompt_id: str, poll_interval: float, max_wait: int) -> Dict[str, Any]:
+    """Poll the history endpoint on the shared event loop."""
+    session = await get_aiohttp_session()
     start_time = time.time()
-    
+
     while time.time() - start_time < max_wait:
         try:
-            response = requests.get(f"{COMFY_URL}/history/{prompt_id}", timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            if prompt_id in data and "outputs" in data[prompt_id]:
+            async with session.get(
+                f"{COMFY_URL}/history/{prompt_id}",
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                response.raise_for_status()
+                content = await response.read()
+
+            result = parse_history(content, prompt_id)
+            if result:
                 logger.info(f"Workflow {prompt_id} completed successfully")
-                return data[prompt_id]
-                
+                return result
+
+            await asyncio.sleep(poll_interval)
+
+        except Exception as e:
+            logger.warning(f"Error checking workflow status: {e}")
+            await asyncio.sleep(poll_interval)
+
+    raise TimeoutError(f"Workflow {prompt_id} did not complete within {max_wait} seconds")
+
+def poll_for_completion(prompt_id: str, poll_interval: float = 2.0, max_wait: int = 300) -> Dict[str, Any]:
+    """Poll the history endpoint until the workflow completes."""
+    if aiohttp is not None:
+        future = asyncio.run_coroutine_threadsafe(
+            poll_for_completion_async(prompt_id, poll_interval, max_wait),
+            get_async_loop()
+        )
+        return future.result()
+
+    start_time = time.time()
+
+    while time.time() - start_time < max_wait:
+        try:
+            result = fetch_history(prompt_id)
+            if result:
+                logger.info(f"Workflow {prompt_id} completed successfully")
+                return result
+
             time.sleep(poll_interval)
-            
+
         except Exception as e:
             logger.warning(f"Error checking workflow status: {e}")
             time.sleep(poll_interval)
-    
+
     raise TimeoutError(f"Workflow {prompt_id} did not complete within {max_wait} seconds")
 
+def wait_for_completion(prompt_id: str, poll_interval: float = 2.0, max_wait: int = 300,
+                        listener: Optional[WorkflowEventListener] = None) -> Dict[str, Any]:
+    """Wait for workflow completion and return results.
+
+    Blocks on the request's WebSocket event listener instead of polling, so
+    the request wakes up as soon as execution finishes. Falls back to polling
+    when no connected listener is available.
+    """
+    if listener is None or not listener.connected.is_set():
+        return poll_for_completion(prompt_id, poll_interval, max_wait)
+
+    if not listener.wait(prompt_id, max_wait):
+        raise TimeoutError(f"Workflow {prompt_id} did not complete within {max_wait} seconds")
+
+    result = fetch_history(prompt_id)
+    if not result:
+        raise ValueError(f"Workflow {prompt_id} finished with no outputs in history")
+
+    logger.info(f"Workflow {prompt_id} completed successfully")
+    return result
+
+# Load balancers probe /health every second or two per replica; cache the
+# ComfyUI round-trip briefly so probes don't pile onto its event loop
+HEALTH_TTL = 1.0
+health_cache = {"t": 0.0, "result": None}
+health_lock = threading.Lock()
+
 @app.route("/health", methods=["GET"])
 def health_check():
     """Health check endpoint."""
-    try:
-        # Check ComfyUI connection
-        response = requests.get(f"{COMFY_URL}/system_stats", timeout=5)
-        response.raise_for_status()
-        
+    now = time.time()
+    with health_lock:
+        cached = health_cache["result"] if now - health_cache["t"] < HEALTH_TTL else None
+
+    if cached is None:
+        try:
+            # Check ComfyUI connection
+            response = http_session.get(f"{COMFY_URL}/system_stats", timeout=5)
+            response.raise_for_status()
+            cached = (True, None)
+        except Exception as e:
+            cached = (False, str(e))
+
+        with health_lock:
+            health_cache["t"] = now
+            health_cache["result"] = cached
+
+    healthy, error = cached
+    if healthy:
         return jsonify({
             "status": "healthy",
             "comfyui": "connected",
             "timestamp": time.time()
         })
-    except Exception as e:
-        return jsonify({
-            "status": "unhealthy",
-            "error": str(e),
-            "timestamp": time.time()
-        }), 503
+    return jsonify({
+        "status": "unhealthy",
+        "error": error,
+        "timestamp": time.time()
+    }), 503
 
 @app.route("/invocations", methods=["POST"])
 def predict():
     """Main inference endpoint compatible with SageMaker."""
     job_id = None
+    # Per-request staging directory, removed below so repeated jobs with
+    # large inputs don't fill the tmpfs backing INPUT_DIR
+    staging_dir = os.path.join(INPUT_DIR, str(uuid.uuid4()))
     try:
         # Parse request
         data = request.get_json()
@@ -171,45 +512,55 @@ def predict():
             if field not in data:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
         
-        # Resolve input paths
-        audio_path = resolve_input_path(data["audio_s3"])
-        transcript_path = resolve_input_path(data["transcript_s3"])
-        image_path = resolve_input_path(data["image_s3"])
+        # Resolve input paths, fetching all three concurrently
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            audio_future = executor.submit(resolve_input_path, data["audio_s3"], staging_dir)
+            transcript_future = executor.submit(resolve_input_path, data["transcript_s3"], staging_dir)
+            image_future = executor.submit(resolve_input_path, data["image_s3"], staging_dir)
+            audio_path = audio_future.result()
+            transcript_path = transcript_future.result()
+            image_path = image_future.result()
         
-        # Load workflow template
-        workflow_path = "/app/ComfyUI/workflows/vibe_infinite.json"
+        # Load workflow template (cached, re-read only when the file changes)
+        workflow_path = DEFAULT_WORKFLOW
         if not os.path.exists(workflow_path):
-            # Use any available workflow as fallback
-            workflow_files = [f for f in os.listdir("/app/ComfyUI/workflows") if f.endswith(".json")]
-            if not workflow_files:
+            if not FALLBACK_WORKFLOW:
                 return jsonify({"error": "No workflow files found"}), 500
-            workflow_path = os.path.join("/app/ComfyUI/workflows", workflow_files[0])
+            workflow_path = FALLBACK_WORKFLOW
             logger.warning(f"Using fallback workflow: {workflow_path}")
+
+        mtime = os.path.getmtime(workflow_path)
+        workflow = fresh_workflow(workflow_path, mtime)
+
+        # Write input paths straight into the pre-indexed slots
+        slots = load_workflow_slots(workflow_path, mtime)
+        input_paths = {
+            "audio": audio_path,
+            "text_file": transcript_path,
+            "image": image_path
+        }
+        for key, path in input_paths.items():
+            for node_id in slots[key]:
+                workflow[node_id]["inputs"][key] = path
         
-        with open(workflow_path, "r") as f:
-            workflow = json.load(f)
-        
-        # Update workflow with input paths (this may need adjustment based on your workflow)
-        # This is a generic approach - you'll need to adjust based on your specific workflow
-        for node_id, node in workflow.items():
-            inputs = node.get("inputs", {})
-            if "audio" in inputs:
-                inputs["audio"] = audio_path
-            if "text_file" in inputs:
-                inputs["text_file"] = transcript_path
-            if "image" in inputs:
-                inputs["image"] = image_path
-        
-        # Submit workflow
-        prompt_id = submit_workflow(workflow)
-        
-        # Wait for completion
-        result = wait_for_completion(prompt_id)
+        # Listen for events before submitting so completion cannot be missed
+        listener = WorkflowEventListener()
+        try:
+            if not listener.start():
+                logger.warning("WebSocket unavailable, will poll for completion")
+
+            # Submit workflow
+            prompt_id = submit_workflow(workflow, listener.client_id)
+
+            # Wait for completion
+            result = wait_for_completion(prompt_id, listener=listener)
+        finally:
+            listener.close()
         
-        # Process outputs
-        outputs = []
+        # Collect outputs to upload
+        pending = []
         output_dir = "/app/ComfyUI/output"
-        
+
         for node_id, node_outputs in result.get("outputs", {}).items():
             # Handle different output types
             for output_type in ["images", "videos", "audio"]:
@@ -218,14 +569,24 @@ def predict():
                     if filename:
                         local_path = os.path.join(output_dir, filename)
                         if os.path.exists(local_path):
-                            url = upload_output(local_path, data["output_s3_bucket"])
-                            outputs.append({
-                                "type": output_type,
-                                "filename": filename,
-                                "url": url
-                            })
+                            pending.append((local_path, filename, output_type))
+
+        # Upload in parallel so N outputs take max() rather than sum() time
+        outputs = []
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
+                executor.submit(upload_output, local_path, data["output_s3_bucket"]): (filename, output_type)
+                for local_path, filename, output_type in pending
+            }
+            for future in as_completed(futures):
+                filename, output_type = futures[future]
+                outputs.append({
+                    "type": output_type,
+                    "filename": filename,
+                    "url": future.result()
+                })
         
-        return jsonify({
+        return json_response({
             "job_id": job_id,
             "status": "COMPLETED",
             "prompt_id": prompt_id,
@@ -238,17 +599,21 @@ def predict():
         logger.error(f"Error processing job {job_id}: {error_msg}")
         logger.error(traceback.format_exc())
         
-        return jsonify({
+        return json_response({
             "job_id": job_id,
             "status": "FAILED",
             "error": error_msg,
             "timestamp": time.time()
-        }), 500
+        }, status=500)
+
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     logger.info("Starting ComfyUI Inference Service")
     logger.info(f"ComfyUI URL: {COMFY_URL}")
     logger.info(f"AWS Region: {AWS_REGION}")
     
-    # Run with Flask development server (gunicorn is preferred for production)
-    app.run(host="0.0.0.0", port=8080, debug=False)
+    # Run with Flask development server (gunicorn gthread is preferred for
+    # production, see entrypoint.sh)
+    app.run(host="0.0.0.0", port=8080, debug=False, threaded=True)
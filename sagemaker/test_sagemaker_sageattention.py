@@ -8,32 +8,9 @@ import sys
 import base64
 from datetime import datetime
 
-class SageMakerSageAttentionTester:
-    def __init__(self, role_arn=None, instance_type="ml.g6.xlarge"):
-        self.sagemaker = boto3.client('sagemaker')
-        self.instance_type = instance_type
-        self.role_arn = role_arn or self._get_default_role()
-        self.notebook_instance_name = f"sageattention-test-{int(time.time())}"
-
-    def _get_default_role(self):
-        """Get default SageMaker execution role"""
-        try:
-            iam = boto3.client('iam')
-            roles = iam.list_roles()
-            for role in roles['Roles']:
-                if 'SageMaker' in role['RoleName']:
-                    return role['Arn']
-            raise Exception("No SageMaker role found. Please provide role_arn parameter.")
-        except Exception as e:
-            print(f"Error getting default role: {e}")
-            return None
-
-    def create_notebook_instance(self):
-        """Create SageMaker notebook instance"""
-        print(f"Creating SageMaker notebook instance: {self.notebook_instance_name}")
-        print(f"Instance type: {self.instance_type}")
-
-        lifecycle_config_content = '''#!/bin/bash
+# Lifecycle script built and base64-encoded once at import time so it can be
+# statically validated and reused across runs without re-encoding.
+LIFECYCLE_CONFIG_CONTENT = '''#!/bin/bash
 set -e
 
 # Create version check script
@@ -42,12 +19,13 @@ cat > /home/ec2-user/SageMaker/check_versions.py << 'EOF'
 
 import subprocess
 import sys
-import pkg_resources
 import platform
+from datetime import datetime
+from importlib.metadata import version, PackageNotFoundError
 
 def run_command(cmd):
     try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = subprocess.run(cmd, capture_output=True, text=True)
         return result.stdout.strip(), result.stderr.strip(), result.returncode
     except Exception as e:
         return "", str(e), 1
@@ -56,7 +34,7 @@ def check_versions():
     print("=" * 60)
     print("SAGEATTENTION ENVIRONMENT VERSION CHECK")
     print("=" * 60)
-    print(f"Timestamp: {subprocess.run('date', shell=True, capture_output=True, text=True).stdout.strip()}")
+    print(f"Timestamp: {datetime.now().isoformat()}")
     print(f"Instance type: ml.g6.xlarge")
     print()
 
@@ -69,18 +47,21 @@ def check_versions():
 
     # NVIDIA driver and CUDA
     print("NVIDIA/CUDA INFORMATION:")
-    nvidia_smi, _, _ = run_command("nvidia-smi --query-gpu=driver_version,name,memory.total --format=csv,noheader")
+    nvidia_smi, _, _ = run_command(["nvidia-smi", "--query-gpu=driver_version,name,memory.total", "--format=csv,noheader"])
     if nvidia_smi:
         print(f"GPU Info: {nvidia_smi}")
 
-    nvcc_version, _, _ = run_command("nvcc --version")
+    nvcc_version, _, _ = run_command(["nvcc", "--version"])
     if nvcc_version:
         print("NVCC Version:")
         print(nvcc_version)
 
-    cuda_version, _, _ = run_command("cat /usr/local/cuda/version.txt 2>/dev/null || echo 'CUDA version file not found'")
-    if cuda_version:
-        print(f"CUDA Version: {cuda_version}")
+    try:
+        with open("/usr/local/cuda/version.txt") as f:
+            cuda_version = f.read().strip()
+    except OSError:
+        cuda_version = "CUDA version file not found"
+    print(f"CUDA Version: {cuda_version}")
     print()
 
     # Python packages relevant to SageAttention
@@ -95,9 +76,8 @@ def check_versions():
 
     for package in packages_to_check:
         try:
-            version = pkg_resources.get_distribution(package).version
-            print(f"{package}: {version}")
-        except pkg_resources.DistributionNotFound:
+            print(f"{package}: {version(package)}")
+        except PackageNotFoundError:
             print(f"{package}: Not installed")
         except Exception as e:
             print(f"{package}: Error - {e}")
@@ -152,16 +132,40 @@ python3 /home/ec2-user/SageMaker/check_versions.py > /home/ec2-user/SageMaker/ve
 echo "Setup complete. Version report saved to /home/ec2-user/SageMaker/version_report.txt"
 '''
 
+LIFECYCLE_CONFIG_B64 = base64.b64encode(LIFECYCLE_CONFIG_CONTENT.encode('utf-8')).decode('utf-8')
+
+class SageMakerSageAttentionTester:
+    def __init__(self, role_arn=None, instance_type="ml.g6.xlarge"):
+        self.sagemaker = boto3.client('sagemaker')
+        self.instance_type = instance_type
+        self.role_arn = role_arn or self._get_default_role()
+        self.notebook_instance_name = f"sageattention-test-{int(time.time())}"
+
+    def _get_default_role(self):
+        """Get default SageMaker execution role"""
+        try:
+            iam = boto3.client('iam')
+            roles = iam.list_roles()
+            for role in roles['Roles']:
+                if 'SageMaker' in role['RoleName']:
+                    return role['Arn']
+            raise Exception("No SageMaker role found. Please provide role_arn parameter.")
+        except Exception as e:
+            print(f"Error getting default role: {e}")
+            return None
+
+    def create_notebook_instance(self):
+        """Create SageMaker notebook instance"""
+        print(f"Creating SageMaker notebook instance: {self.notebook_instance_name}")
+        print(f"Instance type: {self.instance_type}")
+
         # Create lifecycle configuration
         lifecycle_config_name = f"sageattention-lifecycle-{int(time.time())}"
         try:
-            # Encode the content as base64
-            encoded_content = base64.b64encode(lifecycle_config_content.encode('utf-8')).decode('utf-8')
-
             self.sagemaker.create_notebook_instance_lifecycle_config(
                 NotebookInstanceLifecycleConfigName=lifecycle_config_name,
                 OnStart=[{
-                    'Content': encoded_content
+                    'Content': LIFECYCLE_CONFIG_B64
                 }]
             )
             print(f"Created lifecycle configuration: {lifecycle_config_name}")
@@ -188,32 +192,31 @@ echo "Setup complete. Version report saved to /home/ec2-user/SageMaker/version_r
     def wait_for_instance(self, timeout_minutes=15):
         """Wait for notebook instance to be ready"""
         print("Waiting for notebook instance to be ready...")
-        start_time = time.time()
-        timeout_seconds = timeout_minutes * 60
-
-        while time.time() - start_time < timeout_seconds:
+        waiter = self.sagemaker.get_waiter('notebook_instance_in_service')
+        try:
+            waiter.wait(
+                NotebookInstanceName=self.notebook_instance_name,
+                WaiterConfig={'Delay': 15, 'MaxAttempts': max(1, timeout_minutes * 60 // 15)}
+            )
+        except Exception:
             try:
                 response = self.sagemaker.describe_notebook_instance(
                     NotebookInstanceName=self.notebook_instance_name
                 )
-                status = response['NotebookInstanceStatus']
-                print(f"Status: {status}")
-
-                if status == 'InService':
-                    print(f"✓ Notebook instance is ready!")
-                    print(f"URL: {response.get('Url', 'N/A')}")
-                    return True
-                elif status == 'Failed':
+                if response['NotebookInstanceStatus'] == 'Failed':
                     print(f"✗ Notebook instance failed: {response.get('FailureReason', 'Unknown')}")
                     return False
-
-                time.sleep(30)
             except Exception as e:
                 print(f"Error checking status: {e}")
-                time.sleep(30)
+            print(f"✗ Timeout waiting for notebook instance after {timeout_minutes} minutes")
+            return False
 
-        print(f"✗ Timeout waiting for notebook instance after {timeout_minutes} minutes")
-        return False
+        response = self.sagemaker.describe_notebook_instance(
+            NotebookInstanceName=self.notebook_instance_name
+        )
+        print(f"✓ Notebook instance is ready!")
+        print(f"URL: {response.get('Url', 'N/A')}")
+        return True
 
     def get_version_report(self):
         """Retrieve version report from the notebook instance"""
@@ -250,23 +253,24 @@ echo "Setup complete. Version report saved to /home/ec2-user/SageMaker/version_r
                 NotebookInstanceName=self.notebook_instance_name
             )
 
-            # Wait for it to stop
-            while True:
-                response = self.sagemaker.describe_notebook_instance(
-                    NotebookInstanceName=self.notebook_instance_name
+            # Wait for it to stop; still attempt the delete if the waiter
+            # errors (e.g. a Failed instance), so we never leak the instance
+            try:
+                self.sagemaker.get_waiter('notebook_instance_stopped').wait(
+                    NotebookInstanceName=self.notebook_instance_name,
+                    WaiterConfig={'Delay': 15, 'MaxAttempts': 60}
                 )
-                status = response['NotebookInstanceStatus']
-                if status == 'Stopped':
-                    break
-                elif status == 'Failed':
-                    print(f"Stop failed: {response.get('FailureReason', 'Unknown')}")
-                    break
-                time.sleep(30)
+            except Exception as e:
+                print(f"Error waiting for stop (attempting delete anyway): {e}")
 
             # Delete the instance
             self.sagemaker.delete_notebook_instance(
                 NotebookInstanceName=self.notebook_instance_name
             )
+            self.sagemaker.get_waiter('notebook_instance_deleted').wait(
+                NotebookInstanceName=self.notebook_instance_name,
+                WaiterConfig={'Delay': 15, 'MaxAttempts': 60}
+            )
             print("✓ Notebook instance deleted")
 
         except Exception as e:
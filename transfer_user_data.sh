@@ -9,15 +9,17 @@ apt-get update -y
 # Install Python, pip, and AWS CLI
 apt-get install -y python3 python3-pip awscli
 
-# Install HuggingFace Hub
-pip3 install huggingface_hub
+# Install transfer script dependencies
+pip3 install huggingface_hub boto3
 
 # Create transfer script directory
 mkdir -p /home/ubuntu/scripts
 cd /home/ubuntu/scripts
 
 # Download the transfer script from our repo
-wget -O hf_to_s3_transfer.py https://raw.githubusercontent.com/dcpedit/comfy-cloud/main/hf_to_s3_transfer.py 2>/dev/null || cat > hf_to_s3_transfer.py << 'EOF'
+if ! wget -O hf_to_s3_transfer.py https://raw.githubusercontent.com/dcpedit/comfy-cloud/main/hf_to_s3_transfer.py 2>/dev/null; then
+    echo "⚠️  wget failed, using bundled copy of the transfer script"
+    cat > hf_to_s3_transfer.py << 'EOF'
 #!/usr/bin/env python3
 """
 HuggingFace to S3 Transfer Script
@@ -27,60 +29,165 @@ Usage: python3 hf_to_s3_transfer.py <hf_repo_id> <s3_bucket> [s3_prefix]
 import os
 import sys
 import subprocess
-import tempfile
-import shutil
-from huggingface_hub import snapshot_download
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from huggingface_hub import HfFileSystem
+
+# Each streamed file buffers at most max_concurrency in-flight 8 MB parts, so
+# peak memory stays around MAX_PARALLEL_FILES * 8 * 8 MB (~1 GB) regardless of
+# model size. 8 MB parts stay well under S3's 10k-part limit for any shard.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+MAX_PARALLEL_FILES = 16
+
+# Redundant pickle weights to skip when safetensors copies exist
+PICKLE_SUFFIXES = (".bin", ".pt", ".ckpt")
+
+def list_transfer_files(fs, repo_id):
+    """List repo files to transfer, skipping redundant pickle weights"""
+    details = fs.find(repo_id, detail=True)
+    files = {path[len(repo_id) + 1:]: info for path, info in details.items()}
+
+    if any(name.endswith(".safetensors") for name in files):
+        files = {
+            name: info for name, info in files.items()
+            if not name.endswith(PICKLE_SUFFIXES)
+        }
+    return files
+
+def stream_file(fs, s3_client, repo_id, rel_path, s3_bucket, key):
+    """Stream one file from HuggingFace straight into an S3 multipart upload"""
+    with fs.open(f"{repo_id}/{rel_path}", "rb") as stream:
+        s3_client.upload_fileobj(stream, s3_bucket, key, Config=TRANSFER_CONFIG)
+
+def try_s3_copy(s3_client, repo_id, s3_bucket, key_prefix):
+    """Server-side copy from a mirror bucket; returns True when fully copied.
+
+    When HF_S3_CACHE_BUCKET points at a bucket holding the repo under
+    {repo_id}/, UploadPartCopy moves the bytes entirely inside S3 and nothing
+    transits this instance. Returns False when the cache is absent or
+    incomplete so the caller falls back to streaming from HuggingFace.
+    """
+    cache_bucket = os.environ.get("HF_S3_CACHE_BUCKET")
+    if not cache_bucket:
+        return False
+
+    src_prefix = f"{repo_id}/"
+    try:
+        keys = []
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=cache_bucket, Prefix=src_prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    except Exception as e:
+        print(f"⚠️  Could not list s3://{cache_bucket}/{src_prefix}: {e}")
+        return False
+
+    if not keys:
+        print(f"ℹ️  No cached copy at s3://{cache_bucket}/{src_prefix}, using HuggingFace")
+        return False
+
+    print(f"📋 Server-side copying {len(keys)} files from s3://{cache_bucket}/{src_prefix}")
+    failed = []
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        futures = {
+            executor.submit(
+                s3_client.copy,
+                {"Bucket": cache_bucket, "Key": key},
+                s3_bucket,
+                f"{key_prefix}{key[len(src_prefix):]}",
+                Config=TRANSFER_CONFIG
+            ): key
+            for key in keys
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Copy failed for {key}: {e}")
+                failed.append(key)
+
+    if failed:
+        print(f"⚠️  {len(failed)}/{len(keys)} copies failed, falling back to HuggingFace")
+        return False
+
+    print(f"✅ Copied {len(keys)} files server-side")
+    return True
+
+def print_s3_summary(s3_path):
+    """Show file count and size for the uploaded prefix"""
+    # Iterate the listing line by line; buffering the whole recursive listing
+    # costs O(file count) memory for repos with thousands of shards
+    proc = subprocess.Popen([
+        "aws", "s3", "ls", s3_path, "--recursive", "--human-readable", "--summarize"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+
+    for line in proc.stdout:
+        if 'Total' in line:
+            print(f"📊 {line.strip()}")
+    proc.wait()
 
 def transfer_model(repo_id, s3_bucket, s3_prefix="models"):
     """Transfer a HuggingFace model to S3"""
     print(f"🚀 Starting transfer: {repo_id} → s3://{s3_bucket}/{s3_prefix}/")
 
-    # Create temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
-        model_dir = os.path.join(temp_dir, "model")
-
-        print(f"📥 Downloading from HuggingFace...")
-        try:
-            # Download from HuggingFace
-            snapshot_download(
-                repo_id=repo_id,
-                local_dir=model_dir,
-                local_dir_use_symlinks=False
-            )
-            print(f"✅ Download completed")
-
-            # Upload to S3
-            s3_path = f"s3://{s3_bucket}/{s3_prefix}/{repo_id.replace('/', '_')}/"
-            print(f"📤 Uploading to {s3_path}")
-
-            result = subprocess.run([
-                "aws", "s3", "sync", model_dir, s3_path,
-                "--delete", "--quiet"
-            ], capture_output=True, text=True)
-
-            if result.returncode == 0:
-                print(f"✅ Transfer completed successfully!")
-                print(f"📍 Location: {s3_path}")
-
-                # Show file count and size
-                size_result = subprocess.run([
-                    "aws", "s3", "ls", s3_path, "--recursive", "--human-readable", "--summarize"
-                ], capture_output=True, text=True)
-
-                if size_result.returncode == 0:
-                    lines = size_result.stdout.strip().split('\n')
-                    summary_lines = [line for line in lines if 'Total' in line]
-                    for line in summary_lines:
-                        print(f"📊 {line}")
-
-            else:
-                print(f"❌ S3 upload failed: {result.stderr}")
-                return False
-
-        except Exception as e:
-            print(f"❌ Error: {e}")
+    key_prefix = f"{s3_prefix}/{repo_id.replace('/', '_')}/"
+    s3_path = f"s3://{s3_bucket}/{key_prefix}"
+
+    try:
+        s3_client = boto3.client("s3")
+
+        # Fast path: copy inside S3 when the model is already mirrored there
+        if try_s3_copy(s3_client, repo_id, s3_bucket, key_prefix):
+            print(f"✅ Transfer completed successfully!")
+            print(f"📍 Location: {s3_path}")
+            print_s3_summary(s3_path)
+            return True
+
+        fs = HfFileSystem()
+        files = list_transfer_files(fs, repo_id)
+        if not files:
+            print(f"❌ No files found in {repo_id}")
+            return False
+
+        total_gib = sum(info.get("size") or 0 for info in files.values()) / 1024**3
+        print(f"📥 Streaming {len(files)} files ({total_gib:.2f} GiB) to {s3_path}")
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_FILES) as executor:
+            futures = {
+                executor.submit(
+                    stream_file, fs, s3_client, repo_id, rel_path,
+                    s3_bucket, f"{key_prefix}{rel_path}"
+                ): rel_path
+                for rel_path in files
+            }
+            for future in as_completed(futures):
+                rel_path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"❌ Upload failed for {rel_path}: {e}")
+                    failed.append(rel_path)
+
+        if failed:
+            print(f"❌ S3 upload failed for {len(failed)}/{len(files)} files")
             return False
 
+        print(f"✅ Transfer completed successfully! ({len(files)} files)")
+        print(f"📍 Location: {s3_path}")
+        print_s3_summary(s3_path)
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
     return True
 
 def main():
@@ -111,6 +218,7 @@ def main():
 if __name__ == "__main__":
     main()
 EOF
+fi
 
 # Make executable
 chmod +x hf_to_s3_transfer.py